@@ -1,6 +1,8 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, Header, HTTPException, Query
+from fastapi.responses import StreamingResponse
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.asyncio import AsyncSession
-from typing import List
+from typing import List, Optional
 from app.db.database import get_db
 from app.services.currency_service import CurrencyService
 from app.schemas.currency import (
@@ -11,10 +13,11 @@ from app.schemas.currency import (
 from app.tasks.background_task import background_task
 from app.nats.client import nats_client
 from app.ws.manager import ws_manager
+from app.debug.tracing import TracedRoute
 from datetime import datetime
 
 
-router = APIRouter()
+router = APIRouter(route_class=TracedRoute)
 
 
 @router.get("/items", response_model=List[CurrencyRateResponse])
@@ -23,6 +26,27 @@ async def get_items(session: AsyncSession = Depends(get_db)):
     return items
 
 
+@router.get("/items/stream")
+async def stream_items(
+    pairs: Optional[str] = Query(None, description="Фильтр пар через запятую, например USD/EUR,USDT/BTC"),
+    last_event_id: Optional[str] = Header(None)
+):
+    pair_filter = None
+    if pairs:
+        pair_filter = set()
+        for pair in pairs.split(","):
+            parts = pair.strip().upper().split("/")
+            if len(parts) != 2 or not all(parts):
+                raise HTTPException(status_code=400, detail=f"Invalid pair: {pair!r}")
+            pair_filter.add((parts[0], parts[1]))
+    
+    return StreamingResponse(
+        ws_manager.stream(last_event_id, pair_filter),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
 @router.get("/items/{item_id}", response_model=CurrencyRateResponse)
 async def get_item(item_id: int, session: AsyncSession = Depends(get_db)):
     item = await CurrencyService.get_by_id(session, item_id)
@@ -36,12 +60,16 @@ async def create_item(
     item_data: CurrencyRateCreate, 
     session: AsyncSession = Depends(get_db)
 ):
-    item = await CurrencyService.create(session, item_data)
+    try:
+        item = await CurrencyService.create(session, item_data)
+    except IntegrityError:
+        await session.rollback()
+        raise HTTPException(status_code=409, detail="Item for this currency pair already exists")
     
-    await nats_client.publish("items.updates", {
+    await ws_manager.broadcast({
         "type": "item_created",
-        "item_id": item.id,
-        "data": {
+        "item": {
+            "id": item.id,
             "base_currency": item.base_currency,
             "target_currency": item.target_currency,
             "rate": item.rate
@@ -49,10 +77,10 @@ async def create_item(
         "timestamp": datetime.now().isoformat()
     })
     
-    await ws_manager.broadcast({
+    await nats_client.publish("items.updates", {
         "type": "item_created",
-        "item": {
-            "id": item.id,
+        "item_id": item.id,
+        "data": {
             "base_currency": item.base_currency,
             "target_currency": item.target_currency,
             "rate": item.rate
@@ -76,10 +104,10 @@ async def update_item(
     old_rate = item.rate
     item = await CurrencyService.update(session, item, item_data)
     
-    await nats_client.publish("items.updates", {
+    await ws_manager.broadcast({
         "type": "item_updated",
-        "item_id": item.id,
-        "data": {
+        "item": {
+            "id": item.id,
             "base_currency": item.base_currency,
             "target_currency": item.target_currency,
             "old_rate": old_rate,
@@ -88,10 +116,10 @@ async def update_item(
         "timestamp": datetime.now().isoformat()
     })
     
-    await ws_manager.broadcast({
+    await nats_client.publish("items.updates", {
         "type": "item_updated",
-        "item": {
-            "id": item.id,
+        "item_id": item.id,
+        "data": {
             "base_currency": item.base_currency,
             "target_currency": item.target_currency,
             "old_rate": old_rate,
@@ -118,16 +146,16 @@ async def delete_item(item_id: int, session: AsyncSession = Depends(get_db)):
     
     await CurrencyService.delete(session, item)
     
-    await nats_client.publish("items.updates", {
+    await ws_manager.broadcast({
         "type": "item_deleted",
-        "item_id": item_id,
-        "data": item_data,
+        "item": item_data,
         "timestamp": datetime.now().isoformat()
     })
     
-    await ws_manager.broadcast({
+    await nats_client.publish("items.updates", {
         "type": "item_deleted",
-        "item": item_data,
+        "item_id": item_id,
+        "data": item_data,
         "timestamp": datetime.now().isoformat()
     })
 
@@ -1,11 +1,42 @@
+from uuid import uuid4
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.schema import CreateIndex
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker
 from sqlalchemy.orm import declarative_base
 from config import settings
 
+
+def _engine_options(database_url: str) -> dict:
+    # Для PostgreSQL (asyncpg) — пул соединений, общий для нескольких узлов приложения;
+    # SQLite и другие драйверы оставляем с настройками по умолчанию
+    if make_url(database_url).get_driver_name() != "asyncpg":
+        return {}
+
+    connect_args = {
+        # Кэш подготовленных выражений диалекта SQLAlchemy и собственный кэш asyncpg
+        "prepared_statement_cache_size": settings.db_statement_cache_size,
+        "statement_cache_size": settings.db_statement_cache_size
+    }
+    if settings.db_statement_cache_size == 0:
+        # pgbouncer (transaction): без кэша и с уникальными именами выражений,
+        # чтобы не конфликтовать на разделяемых серверных соединениях
+        connect_args["prepared_statement_name_func"] = lambda: f"__asyncpg_{uuid4()}__"
+
+    return {
+        "pool_size": settings.db_pool_size,
+        "max_overflow": settings.db_max_overflow,
+        "pool_pre_ping": settings.db_pool_pre_ping,
+        "pool_recycle": settings.db_pool_recycle_seconds,
+        "connect_args": connect_args
+    }
+
+
 engine = create_async_engine(
     settings.database_url,
     echo=True,
-    future=True
+    future=True,
+    **_engine_options(settings.database_url)
 )
 
 AsyncSessionLocal = async_sessionmaker(
@@ -25,8 +56,50 @@ async def get_db():
             await session.close()
 
 
-async def init_db():
-    async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
+# Оставляет по одной (самой свежей) записи на пару: базы, созданные до уникального
+# индекса, могли получить дубликаты через POST /items
+_DEDUPE_PAIRS_SQL = text("""
+    DELETE FROM currency_rates WHERE id IN (
+        SELECT id FROM (
+            SELECT id, ROW_NUMBER() OVER (
+                PARTITION BY base_currency, target_currency
+                ORDER BY
+                    CASE WHEN COALESCE(updated_at, created_at) IS NULL THEN 1 ELSE 0 END,
+                    COALESCE(updated_at, created_at) DESC,
+                    id DESC
+            ) AS row_number
+            FROM currency_rates
+            WHERE base_currency IS NOT NULL AND target_currency IS NOT NULL
+        ) ranked
+        WHERE row_number > 1
+    )
+""")
+
 
+def _ensure_pair_index(connection):
+    from app.models.currency import CurrencyRate, currency_pair_index
 
+    # create_all не добавляет индексы в уже существующие таблицы,
+    # а уникальный индекс по паре нужен для upsert
+    indexes = inspect(connection).get_indexes(CurrencyRate.__tablename__)
+    if any(index["name"] == currency_pair_index.name for index in indexes):
+        return
+
+    removed = connection.execute(_DEDUPE_PAIRS_SQL).rowcount
+    if removed:
+        print(f"Удалено дубликатов валютных пар перед созданием уникального индекса: {removed}")
+    connection.execute(CreateIndex(currency_pair_index, if_not_exists=True))
+
+
+# Ключ advisory-блокировки PostgreSQL на время создания схемы
+_INIT_DB_LOCK_KEY = 7_420_001
+
+
+async def init_db(db_engine=engine):
+    async with db_engine.begin() as conn:
+        if conn.dialect.name == "postgresql":
+            # Узлы, стартующие одновременно, создают таблицы и индекс по очереди:
+            # блокировка снимается вместе с транзакцией, следующий узел уже видит индекс
+            await conn.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": _INIT_DB_LOCK_KEY})
+        await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(_ensure_pair_index)
@@ -0,0 +1,51 @@
+import asyncio
+import sys
+import threading
+from collections import Counter
+from typing import Counter as CounterType
+
+
+class SamplingProfiler:
+    """Сэмплирующий профилировщик потока event loop на основе sys._current_frames()"""
+
+    def __init__(self):
+        self.running = False
+
+    async def profile(self, seconds: float, interval: float) -> str:
+        """Снимает стеки потока event loop в течение seconds; возвращает collapsed stacks"""
+        thread_id = threading.get_ident()
+        counts: CounterType[str] = Counter()
+        stop = threading.Event()
+        sampler = threading.Thread(
+            target=self._sample,
+            args=(thread_id, interval, stop, counts),
+            name="sampling-profiler",
+            daemon=True
+        )
+
+        self.running = True
+        sampler.start()
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            stop.set()
+            await asyncio.to_thread(sampler.join)
+            self.running = False
+
+        # Формат collapsed stacks: "frame;frame;frame count" — вход для flamegraph.pl / speedscope
+        return "\n".join(f"{stack} {count}" for stack, count in counts.most_common())
+
+    @staticmethod
+    def _sample(thread_id: int, interval: float, stop: threading.Event, counts: Counter):
+        while not stop.wait(interval):
+            frame = sys._current_frames().get(thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({code.co_filename}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if stack:
+                counts[";".join(reversed(stack))] += 1
+
+
+profiler = SamplingProfiler()
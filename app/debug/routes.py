@@ -0,0 +1,50 @@
+import secrets
+from typing import Optional
+from fastapi import APIRouter, Depends, Header, HTTPException, Query
+from fastapi.responses import PlainTextResponse
+from app.debug.profiler import profiler
+from app.debug.tracing import tracer
+from config import settings
+
+
+async def require_admin(x_admin_token: Optional[str] = Header(None)):
+    # Без ADMIN_TOKEN отладочные эндпоинты выключены
+    if not settings.admin_token:
+        raise HTTPException(status_code=403, detail="Debug endpoints are disabled")
+    if not x_admin_token or not secrets.compare_digest(x_admin_token, settings.admin_token):
+        raise HTTPException(status_code=403, detail="Invalid admin token")
+
+
+router = APIRouter(prefix="/debug", dependencies=[Depends(require_admin)])
+
+
+@router.post("/profile", response_class=PlainTextResponse)
+async def run_profile(
+    seconds: float = Query(10.0, gt=0, le=120),
+    interval_ms: float = Query(5.0, ge=1, le=1000)
+):
+    if profiler.running:
+        raise HTTPException(status_code=409, detail="Profiler is already running")
+    return await profiler.profile(seconds, interval_ms / 1000)
+
+
+@router.get("/traces")
+async def get_traces(
+    slowest: Optional[int] = Query(None, ge=1, le=1000),
+    limit: int = Query(50, ge=1, le=1000)
+):
+    return {
+        "enabled": tracer.enabled,
+        "traces": tracer.get_traces(slowest=slowest, limit=limit)
+    }
+
+
+@router.put("/traces")
+async def set_tracing(enabled: bool):
+    tracer.enabled = enabled
+    return {"enabled": tracer.enabled}
+
+
+@router.delete("/traces", status_code=204)
+async def clear_traces():
+    tracer.traces.clear()
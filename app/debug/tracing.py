@@ -0,0 +1,142 @@
+import asyncio
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+from functools import wraps
+from typing import Callable, Deque, Dict, List, Optional, Set, Tuple
+from fastapi.routing import APIRoute
+from config import settings
+
+
+class Trace:
+    """Трассировка одного запроса или цикла фоновой задачи"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.started_at = datetime.now()
+        self.start = time.perf_counter()
+        self.duration = 0.0
+        self.status_code: Optional[int] = None
+        self.handler_end: Optional[float] = None
+        # Имя span -> (суммарное время, количество вызовов)
+        self.spans: Dict[str, Tuple[float, int]] = {}
+        self.open_spans: Set[str] = set()
+
+    def add_span(self, name: str, duration: float):
+        total, count = self.spans.get(name, (0.0, 0))
+        self.spans[name] = (total + duration, count + 1)
+
+    def to_dict(self) -> dict:
+        return {
+            "name": self.name,
+            "started_at": self.started_at.isoformat(),
+            "duration_ms": round(self.duration * 1000, 3),
+            "status_code": self.status_code,
+            "spans": {
+                name: {"total_ms": round(total * 1000, 3), "count": count}
+                for name, (total, count) in self.spans.items()
+            }
+        }
+
+
+_current_trace: ContextVar[Optional[Trace]] = ContextVar("current_trace", default=None)
+
+
+class Tracer:
+    def __init__(self):
+        self.enabled = settings.tracing_enabled
+        self.traces: Deque[Trace] = deque(maxlen=settings.trace_buffer_size)
+
+    @contextmanager
+    def trace(self, name: str):
+        if not self.enabled:
+            yield None
+            return
+
+        trace = Trace(name)
+        token = _current_trace.set(trace)
+        try:
+            yield trace
+        finally:
+            trace.duration = time.perf_counter() - trace.start
+            _current_trace.reset(token)
+            self.traces.append(trace)
+
+    def get_traces(self, slowest: Optional[int] = None, limit: int = 50) -> List[dict]:
+        traces = list(self.traces)
+        if slowest is not None:
+            traces = sorted(traces, key=lambda t: t.duration, reverse=True)[:slowest]
+        else:
+            traces = traces[-limit:][::-1]
+        return [trace.to_dict() for trace in traces]
+
+
+def traced(name: str):
+    """Учитывает время вызова корутины как span текущей трассировки"""
+    def decorator(func: Callable):
+        @wraps(func)
+        async def wrapper(*args, **kwargs):
+            trace = _current_trace.get()
+            # Без активной трассировки или внутри span с тем же именем — ничего не меряем
+            if trace is None or name in trace.open_spans:
+                return await func(*args, **kwargs)
+
+            trace.open_spans.add(name)
+            start = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                trace.add_span(name, time.perf_counter() - start)
+                trace.open_spans.discard(name)
+        return wrapper
+    return decorator
+
+
+class TracedRoute(APIRoute):
+    """Отмечает окончание обработчика, чтобы отделить время сериализации ответа"""
+
+    def __init__(self, path: str, endpoint: Callable, **kwargs):
+        # Синхронные обработчики FastAPI выполняет в пуле потоков — их не оборачиваем
+        if not asyncio.iscoroutinefunction(endpoint):
+            super().__init__(path, endpoint, **kwargs)
+            return
+
+        @wraps(endpoint)
+        async def traced_endpoint(*args, **values):
+            try:
+                return await endpoint(*args, **values)
+            finally:
+                trace = _current_trace.get()
+                if trace is not None:
+                    trace.handler_end = time.perf_counter()
+
+        super().__init__(path, traced_endpoint, **kwargs)
+
+
+class TracingMiddleware:
+    """ASGI-middleware: при выключенной трассировке — только проверка флага"""
+
+    def __init__(self, app, exclude_paths: Optional[Set[str]] = None):
+        self.app = app
+        # Долгоживущие потоки (SSE) не трассируем: они забили бы список самых медленных
+        self.exclude_paths = exclude_paths or set()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not tracer.enabled or scope["path"] in self.exclude_paths:
+            await self.app(scope, receive, send)
+            return
+
+        with tracer.trace(f"{scope['method']} {scope['path']}") as trace:
+            async def send_wrapper(message):
+                if message["type"] == "http.response.start":
+                    trace.status_code = message["status"]
+                    if trace.handler_end is not None:
+                        trace.add_span("serialize", time.perf_counter() - trace.handler_end)
+                await send(message)
+
+            await self.app(scope, receive, send_wrapper)
+
+
+tracer = Tracer()
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Float, DateTime
+from sqlalchemy import Column, Integer, String, Float, DateTime, Index
 from sqlalchemy.sql import func
 from app.db.database import Base
 
@@ -14,3 +14,12 @@ class CurrencyRate(Base):
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
 
 
+# Одна запись на валютную пару: на этот индекс опирается upsert (ON CONFLICT)
+currency_pair_index = Index(
+    "ux_currency_rates_pair",
+    CurrencyRate.base_currency,
+    CurrencyRate.target_currency,
+    unique=True
+)
+
+
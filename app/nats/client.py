@@ -2,6 +2,7 @@ import json
 from typing import Optional, Callable
 import nats
 from nats.aio.client import Client as NATS
+from app.debug.tracing import traced
 from config import settings
 
 
@@ -24,6 +25,7 @@ class NATSClient:
         if self.nc:
             await self.nc.close()
     
+    @traced("publish")
     async def publish(self, subject: str, data: dict):
         if not self.nc:
             return
@@ -41,12 +43,12 @@ class NATSClient:
         
         self.message_handler = handler
         
+        # Обработчик берём из замыкания: подписок может быть несколько
         async def message_callback(msg):
             try:
                 data = json.loads(msg.data.decode())
                 print(f"📨 Получено сообщение из NATS [{msg.subject}]: {data}")
-                if self.message_handler:
-                    await self.message_handler(data)
+                await handler(data)
             except Exception as e:
                 print(f"❌ Ошибка обработки сообщения из NATS: {e}")
         
@@ -1,18 +1,33 @@
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
-from typing import List, Optional
+from sqlalchemy import select, text
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from typing import Dict, List, Optional, Tuple
 from datetime import datetime, timezone
 from app.models.currency import CurrencyRate
 from app.schemas.currency import CurrencyRateCreate, CurrencyRateUpdate
+from app.debug.tracing import traced
+from config import settings
+
+
+_INSERTS = {
+    "postgresql": postgresql_insert,
+    "sqlite": sqlite_insert
+}
+
+# SQLite ограничивает число параметров в запросе, поэтому многострочный INSERT режем на части
+_UPSERT_BATCH_SIZE = 300
 
 
 class CurrencyService:
     @staticmethod
+    @traced("db")
     async def get_all(session: AsyncSession) -> List[CurrencyRate]:
-        result = await session.execute(select(CurrencyRate))
+        result = await session.execute(select(CurrencyRate).order_by(CurrencyRate.id))
         return result.scalars().all()
     
     @staticmethod
+    @traced("db")
     async def get_by_id(session: AsyncSession, currency_id: int) -> Optional[CurrencyRate]:
         result = await session.execute(
             select(CurrencyRate).where(CurrencyRate.id == currency_id)
@@ -20,6 +35,7 @@ class CurrencyService:
         return result.scalar_one_or_none()
     
     @staticmethod
+    @traced("db")
     async def get_by_currency(
         session: AsyncSession, 
         base_currency: str, 
@@ -34,6 +50,85 @@ class CurrencyService:
         return result.scalar_one_or_none()
     
     @staticmethod
+    @traced("db")
+    async def get_rates_by_base(session: AsyncSession, base_currency: str) -> Dict[str, float]:
+        """Текущие курсы всех пар с базовой валютой одним запросом: {target_currency: rate}"""
+        result = await session.execute(
+            select(CurrencyRate.target_currency, CurrencyRate.rate).where(
+                CurrencyRate.base_currency == base_currency
+            )
+        )
+        return dict(result.all())
+    
+    @staticmethod
+    @traced("db")
+    async def upsert_rates(
+        session: AsyncSession,
+        base_currency: str,
+        rates: Dict[str, float]
+    ) -> List[Tuple[int, str, float]]:
+        """Вставляет или обновляет курсы пакетно (без commit); возвращает (id, target_currency, rate)"""
+        if not rates:
+            return []
+        
+        dialect = session.bind.dialect.name
+        if dialect == "postgresql" and len(rates) >= settings.db_copy_min_rows:
+            return await CurrencyService._copy_upsert_rates(session, base_currency, rates)
+        
+        insert = _INSERTS[dialect]
+        updated_at = datetime.now(timezone.utc)
+        rows = [
+            {"base_currency": base_currency, "target_currency": target_currency, "rate": rate}
+            for target_currency, rate in rates.items()
+        ]
+        
+        upserted = []
+        for start in range(0, len(rows), _UPSERT_BATCH_SIZE):
+            stmt = insert(CurrencyRate).values(rows[start:start + _UPSERT_BATCH_SIZE])
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[CurrencyRate.base_currency, CurrencyRate.target_currency],
+                set_={"rate": stmt.excluded.rate, "updated_at": updated_at}
+            ).returning(CurrencyRate.id, CurrencyRate.target_currency, CurrencyRate.rate)
+            result = await session.execute(stmt)
+            upserted.extend(result.tuples().all())
+        return upserted
+    
+    @staticmethod
+    async def _copy_upsert_rates(
+        session: AsyncSession,
+        base_currency: str,
+        rates: Dict[str, float]
+    ) -> List[Tuple[int, str, float]]:
+        """PostgreSQL: COPY во временную таблицу и один INSERT ... SELECT ... ON CONFLICT"""
+        # DDL через сессию открывает транзакцию, в которой затем выполняется COPY
+        await session.execute(text(
+            "CREATE TEMP TABLE IF NOT EXISTS currency_rates_ingest ("
+            "base_currency VARCHAR, target_currency VARCHAR, rate DOUBLE PRECISION"
+            ") ON COMMIT DELETE ROWS"
+        ))
+        
+        connection = await session.connection()
+        raw_connection = await connection.get_raw_connection()
+        await raw_connection.driver_connection.copy_records_to_table(
+            "currency_rates_ingest",
+            records=[
+                (base_currency, target_currency, rate)
+                for target_currency, rate in rates.items()
+            ],
+            columns=["base_currency", "target_currency", "rate"]
+        )
+        
+        result = await session.execute(text(
+            "INSERT INTO currency_rates (base_currency, target_currency, rate) "
+            "SELECT base_currency, target_currency, rate FROM currency_rates_ingest "
+            "ON CONFLICT (base_currency, target_currency) "
+            "DO UPDATE SET rate = EXCLUDED.rate, updated_at = now() "
+            "RETURNING id, target_currency, rate"
+        ))
+        return result.tuples().all()
+    
+    @staticmethod
+    @traced("db")
     async def create(session: AsyncSession, currency_data: CurrencyRateCreate) -> CurrencyRate:
         currency = CurrencyRate(**currency_data.model_dump())
         session.add(currency)
@@ -42,6 +137,7 @@ class CurrencyService:
         return currency
     
     @staticmethod
+    @traced("db")
     async def update(
         session: AsyncSession, 
         currency: CurrencyRate, 
@@ -56,6 +152,7 @@ class CurrencyService:
         return currency
     
     @staticmethod
+    @traced("db")
     async def delete(session: AsyncSession, currency: CurrencyRate) -> None:
         await session.delete(currency)
         await session.commit()
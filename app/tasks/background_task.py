@@ -1,20 +1,38 @@
 import asyncio
 import httpx
-from datetime import datetime, timezone
+from datetime import datetime
+from sqlalchemy import text
 from sqlalchemy.ext.asyncio import AsyncSession
-from app.db.database import AsyncSessionLocal
+from app.db.database import AsyncSessionLocal, engine
 from app.services.currency_service import CurrencyService
 from app.schemas.currency import CurrencyRateCreate, CurrencyRateUpdate
 from app.nats.client import nats_client
 from app.ws.manager import ws_manager
+from app.debug.tracing import traced, tracer
+from app.tasks.parsing import diff_rates, parse_binance_prices, parse_fiat_rates
+from app.tasks.worker_pool import worker_pool
 from config import settings
 
 
+BINANCE_SYMBOLS = frozenset({
+    "BTCUSDT", "ETHUSDT", "BNBUSDT", "SOLUSDT", "ADAUSDT",
+    "XRPUSDT", "DOTUSDT", "DOGEUSDT", "AVAXUSDT", "MATICUSDT",
+    "LINKUSDT", "UNIUSDT", "LTCUSDT", "ATOMUSDT", "ETCUSDT"
+})
+
+# Ключ advisory-блокировки PostgreSQL: периодический цикл выполняет только её владелец
+LEADER_LOCK_KEY = 7_420_002
+
+
 class BackgroundTask:
-    def __init__(self):
+    def __init__(self, db_engine=engine):
         self.is_running = False
         self.task = None
+        self.db_engine = db_engine
+        # Соединение, удерживающее блокировку лидера (сессионная блокировка живёт, пока оно открыто)
+        self.leader_connection = None
     
+    @traced("fetch")
     async def fetch_exchange_rates(self):
         if settings.api_type == "crypto":
             return await self._fetch_binance_rates()
@@ -41,11 +59,12 @@ class BackgroundTask:
                     return await self._fetch_alternative_api()
                 
                 response.raise_for_status()
-                data = response.json()
-                print(f"Получены данные: base={data.get('base')}, rates_count={len(data.get('rates', {}))}")
-                
-                base_currency = data.get("base", "USD")
-                rates = data.get("rates", {})
+                # Разбор JSON — в пуле обработчиков, а не в event loop
+                base_currency, targets, values = await worker_pool.run(
+                    parse_fiat_rates, response.content
+                )
+                rates = dict(zip(targets, values))
+                print(f"Получены данные: base={base_currency}, rates_count={len(rates)}")
                 
                 if not rates:
                     print("Получен пустой словарь курсов, пробуем альтернативный API")
@@ -68,13 +87,7 @@ class BackgroundTask:
     
     async def _fetch_binance_rates(self):
         try:
-            symbols = [
-                "BTCUSDT", "ETHUSDT", "BNBUSDT", "SOLUSDT", "ADAUSDT",
-                "XRPUSDT", "DOTUSDT", "DOGEUSDT", "AVAXUSDT", "MATICUSDT",
-                "LINKUSDT", "UNIUSDT", "LTCUSDT", "ATOMUSDT", "ETCUSDT"
-            ]
-            
-            print(f"Запрос к Binance API для {len(symbols)} криптовалютных пар")
+            print(f"Запрос к Binance API для {len(BINANCE_SYMBOLS)} криптовалютных пар")
             url = "https://api.binance.com/api/v3/ticker/price"
             
             async with httpx.AsyncClient(timeout=30.0) as client:
@@ -85,18 +98,12 @@ class BackgroundTask:
                     print(f"Ошибка HTTP: {response.status_code}")
                     return None, {}
                 
-                all_prices = response.json()
-                
                 base_currency = "USDT"
-                rates = {}
-                
-                for price_data in all_prices:
-                    symbol = price_data.get("symbol", "")
-                    if symbol in symbols:
-                        target_currency = symbol.replace("USDT", "")
-                        price = float(price_data.get("price", 0))
-                        if price > 0:
-                            rates[target_currency] = price
+                # Разбор и фильтрация полного списка тикеров — в пуле обработчиков
+                targets, values = await worker_pool.run(
+                    parse_binance_prices, response.content, BINANCE_SYMBOLS, base_currency
+                )
+                rates = dict(zip(targets, values))
                 
                 print(f"Получено {len(rates)} криптовалютных курсов")
                 return base_currency, rates
@@ -138,67 +145,75 @@ class BackgroundTask:
             async with httpx.AsyncClient(timeout=30.0) as client:
                 response = await client.get(alt_url)
                 if response.status_code == 200:
-                    data = response.json()
-                    if data.get("success", False) and data.get("rates"):
-                        base_currency = data.get("base", "USD")
-                        rates = data.get("rates", {})
+                    base_currency, targets, values = await worker_pool.run(
+                        parse_fiat_rates, response.content, True
+                    )
+                    if targets:
+                        rates = dict(zip(targets, values))
                         print(f"Альтернативный API успешен: {len(rates)} курсов")
                         return base_currency, rates
         except Exception as e:
             print(f"Альтернативный API также не сработал: {e}")
         return None, {}
     
-    async def save_rates_to_db(self, base_currency: str, rates: dict):
+    @traced("db")
+    async def save_rates_to_db(self, base_currency: str, rates: dict) -> list:
+        """Сохранение курсов; возвращает события item_created/item_updated по изменённым парам"""
         try:
             async with AsyncSessionLocal() as session:
-                updated_count = 0
-                created_count = 0
-                unchanged_count = 0
+                # Один запрос на текущие курсы вместо запроса на каждую пару
+                existing = await CurrencyService.get_rates_by_base(session, base_currency)
                 
-                for target_currency, rate in rates.items():
-                    if target_currency == base_currency:
-                        continue
-                    
-                    try:
-                        existing = await CurrencyService.get_by_currency(
-                            session, base_currency, target_currency
-                        )
-                        
-                        if existing:
-                            if rate is not None and existing.rate != rate:
-                                old_rate = existing.rate
-                                existing.rate = rate
-                                existing.updated_at = datetime.now(timezone.utc)
-                                updated_count += 1
-                                if updated_count <= 5:
-                                    print(f" {base_currency}/{target_currency}: {old_rate} → {rate}")
-                            else:
-                                unchanged_count += 1
-                        else:
-                            from app.models.currency import CurrencyRate
-                            new_currency = CurrencyRate(
-                                base_currency=base_currency,
-                                target_currency=target_currency,
-                                rate=rate
-                            )
-                            session.add(new_currency)
-                            created_count += 1
-                            if created_count <= 5:
-                                print(f"  ➕ Создан {base_currency}/{target_currency}: {rate}")
-                    except Exception as e:
-                        print(f"Ошибка при обработке {base_currency}/{target_currency}: {e}")
-                        import traceback
-                        traceback.print_exc()
-                        continue
+                # Сравнение курсов — в пуле обработчиков
+                changed, unchanged_count = await worker_pool.run(
+                    diff_rates, base_currency, rates, existing
+                )
                 
-                # Один commit для всех изменений
+                # Пакетный upsert только изменившихся пар и один commit
                 try:
+                    upserted = await CurrencyService.upsert_rates(session, base_currency, changed)
                     await session.commit()
-                    print(f"Сохранено в БД: создано {created_count}, обновлено {updated_count}, без изменений {unchanged_count}")
                 except Exception as e:
                     await session.rollback()
                     print(f"Ошибка при commit в БД: {e}")
                     raise
+                
+                timestamp = datetime.now().isoformat()
+                events = []
+                for item_id, target_currency, rate in upserted:
+                    if target_currency in existing:
+                        old_rate = existing[target_currency]
+                        if len(events) < 5:
+                            print(f" {base_currency}/{target_currency}: {old_rate} → {rate}")
+                        events.append({
+                            "type": "item_updated",
+                            "item": {
+                                "id": item_id,
+                                "base_currency": base_currency,
+                                "target_currency": target_currency,
+                                "old_rate": old_rate,
+                                "new_rate": rate
+                            },
+                            "timestamp": timestamp
+                        })
+                    else:
+                        if len(events) < 5:
+                            print(f"  ➕ Создан {base_currency}/{target_currency}: {rate}")
+                        events.append({
+                            "type": "item_created",
+                            "item": {
+                                "id": item_id,
+                                "base_currency": base_currency,
+                                "target_currency": target_currency,
+                                "rate": rate
+                            },
+                            "timestamp": timestamp
+                        })
+                
+                created_count = sum(1 for event in events if event["type"] == "item_created")
+                updated_count = len(events) - created_count
+                print(f"Сохранено в БД: создано {created_count}, обновлено {updated_count}, без изменений {unchanged_count}")
+                return events
         except Exception as e:
             print(f"Критическая ошибка при сохранении в БД: {e}")
             import traceback
@@ -214,29 +229,32 @@ class BackgroundTask:
             
             if base_currency and rates:
                 print(f"Получено курсов: {len(rates)} (базовая валюта: {base_currency})")
-                await self.save_rates_to_db(base_currency, rates)
+                events = await self.save_rates_to_db(base_currency, rates)
                 
-                # Публикация события в NATS
+                # Сначала рассылка клиентам (сразу после коммита), затем публикация в NATS:
+                # изменения по парам и итог цикла
                 try:
-                    await nats_client.publish("items.updates", {
+                    for event in events:
+                        await ws_manager.broadcast(event)
+                    await ws_manager.broadcast({
                         "type": "background_task_completed",
+                        "message": f"Обновлены курсы валют: {len(rates)} валют",
                         "base_currency": base_currency,
-                        "rates_count": len(rates),
                         "timestamp": datetime.now().isoformat()
                     })
                 except Exception as e:
-                    print(f"Ошибка публикации в NATS: {e}")
+                    print(f"Ошибка отправки WebSocket: {e}")
                 
-                # Отправка уведомления через WebSocket
+                # Публикация события в NATS
                 try:
-                    await ws_manager.broadcast({
+                    await nats_client.publish("items.updates", {
                         "type": "background_task_completed",
-                        "message": f"Обновлены курсы валют: {len(rates)} валют",
                         "base_currency": base_currency,
+                        "rates_count": len(rates),
                         "timestamp": datetime.now().isoformat()
                     })
                 except Exception as e:
-                    print(f"Ошибка отправки WebSocket: {e}")
+                    print(f"Ошибка публикации в NATS: {e}")
                 
                 print(f"Фоновая задача завершена: обновлено {len(rates)} курсов")
             else:
@@ -256,9 +274,69 @@ class BackgroundTask:
         print(f"Запуск периодической фоновой задачи (интервал: {settings.task_interval_seconds} сек)")
         
         while self.is_running:
-            await self.run_task()
+            try:
+                is_leader = await self.acquire_leadership()
+            except Exception as e:
+                print(f"Ошибка получения блокировки лидера: {e}")
+                is_leader = False
+
+            if is_leader:
+                # Каждый цикл — отдельная трассировка (ручной запуск попадает в трассировку запроса)
+                with tracer.trace("background_task"):
+                    await self.run_task()
+            else:
+                print("Фоновая задача выполняется другим узлом, цикл пропущен")
             await asyncio.sleep(settings.task_interval_seconds)
     
+    async def acquire_leadership(self) -> bool:
+        """Узлы с общей БД PostgreSQL выполняют цикл по очереди: только владелец блокировки"""
+        if self.db_engine.dialect.name != "postgresql":
+            return True
+
+        if self.leader_connection is not None:
+            # Блокировка снимается сервером при обрыве соединения — проверяем, что оно живо
+            try:
+                await self.leader_connection.execute(text("SELECT 1"))
+                await self.leader_connection.commit()
+                return True
+            except Exception as e:
+                print(f"Потеряно соединение с блокировкой лидера: {e}")
+                await self.leader_connection.invalidate()
+                await self.leader_connection.close()
+                self.leader_connection = None
+
+        connection = await self.db_engine.connect()
+        try:
+            acquired = await connection.scalar(
+                text("SELECT pg_try_advisory_lock(:key)"), {"key": LEADER_LOCK_KEY}
+            )
+            await connection.commit()
+        except Exception:
+            await connection.close()
+            raise
+
+        if not acquired:
+            await connection.close()
+            return False
+
+        self.leader_connection = connection
+        print("Блокировка лидера получена: периодическая задача выполняется на этом узле")
+        return True
+    
+    async def release_leadership(self):
+        if self.leader_connection is None:
+            return
+        connection, self.leader_connection = self.leader_connection, None
+        try:
+            # Соединение вернётся в пул, поэтому блокировку снимаем явно
+            await connection.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": LEADER_LOCK_KEY})
+            await connection.commit()
+        except Exception as e:
+            print(f"Ошибка снятия блокировки лидера: {e}")
+            await connection.invalidate()
+        finally:
+            await connection.close()
+    
     async def stop(self):
         """Остановка фоновой задачи"""
         self.is_running = False
@@ -268,6 +346,7 @@ class BackgroundTask:
                 await self.task
             except asyncio.CancelledError:
                 pass
+        await self.release_leadership()
         print("Фоновая задача остановлена")
 
 
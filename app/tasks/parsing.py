@@ -0,0 +1,58 @@
+import json
+from array import array
+from typing import Dict, FrozenSet, Optional, Tuple
+
+
+def parse_binance_prices(
+    content: bytes,
+    symbols: FrozenSet[str],
+    quote_currency: str
+) -> Tuple[Tuple[str, ...], array]:
+    """Из полного списка тикеров Binance оставляет нужные пары: (валюты, курсы)"""
+    targets = []
+    rates = array("d")
+    for price_data in json.loads(content):
+        symbol = price_data.get("symbol", "")
+        if symbol not in symbols:
+            continue
+        price = float(price_data.get("price", 0))
+        if price > 0:
+            targets.append(symbol[:-len(quote_currency)])
+            rates.append(price)
+    return tuple(targets), rates
+
+
+def parse_fiat_rates(
+    content: bytes,
+    require_success: bool = False
+) -> Tuple[Optional[str], Tuple[str, ...], array]:
+    """Ответ вида {"base": ..., "rates": {...}}: (базовая валюта, валюты, курсы)"""
+    data = json.loads(content)
+    targets = []
+    rates = array("d")
+    # exchangerate.host сообщает об ошибке флагом success
+    if require_success and not data.get("success", False):
+        return data.get("base", "USD"), tuple(targets), rates
+    for target_currency, rate in (data.get("rates") or {}).items():
+        if isinstance(rate, (int, float)):
+            targets.append(target_currency)
+            rates.append(float(rate))
+    return data.get("base", "USD"), tuple(targets), rates
+
+
+def diff_rates(
+    base_currency: str,
+    rates: Dict[str, float],
+    existing: Dict[str, float]
+) -> Tuple[Dict[str, float], int]:
+    """Изменившиеся и новые пары относительно existing и число неизменных"""
+    changed = {}
+    unchanged_count = 0
+    for target_currency, rate in rates.items():
+        if target_currency == base_currency:
+            continue
+        if rate is None or existing.get(target_currency) == rate:
+            unchanged_count += 1
+            continue
+        changed[target_currency] = rate
+    return changed, unchanged_count
@@ -0,0 +1,56 @@
+import asyncio
+import multiprocessing
+from concurrent.futures import BrokenExecutor, Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Callable, Optional
+from config import settings
+
+
+class WorkerPool:
+    """Пул для CPU-нагруженных этапов фоновой задачи, чтобы не блокировать event loop"""
+
+    def __init__(self):
+        self.executor: Optional[Executor] = None
+
+    def start(self):
+        if settings.worker_pool_type == "process":
+            # spawn: дочерние процессы не наследуют состояние event loop и соединений
+            self.executor = ProcessPoolExecutor(
+                max_workers=settings.worker_pool_size,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        elif settings.worker_pool_type == "thread":
+            self.executor = ThreadPoolExecutor(
+                max_workers=settings.worker_pool_size,
+                thread_name_prefix="rates-worker"
+            )
+        else:
+            self.executor = None
+        print(f"Пул обработчиков: {settings.worker_pool_type} ({settings.worker_pool_size})")
+
+    def shutdown(self):
+        if self.executor:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+
+    async def run(self, func: Callable, *args):
+        # Без пула (type=none или вне lifespan) выполняем прямо в текущем потоке
+        if self.executor is None:
+            return func(*args)
+        loop = asyncio.get_running_loop()
+        executor = self.executor
+        try:
+            return await loop.run_in_executor(executor, func, *args)
+        except BrokenExecutor as e:
+            # Упавший процесс ломает пул навсегда: пересоздаём его (один раз на все
+            # одновременные вызовы) и повторяем задачу
+            print(f"Пул обработчиков неисправен, пересоздаём: {e}")
+            if self.executor is executor:
+                self.shutdown()
+                self.start()
+            if self.executor is None:
+                return func(*args)
+            return await loop.run_in_executor(self.executor, func, *args)
+
+
+# Глобальный экземпляр пула
+worker_pool = WorkerPool()
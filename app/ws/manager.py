@@ -1,42 +1,291 @@
-from typing import List
+import asyncio
+import secrets
+from collections import deque
+from typing import AsyncIterator, Deque, Dict, Hashable, List, Optional, Set, Tuple
 from fastapi import WebSocket
 import json
+from app.db.database import AsyncSessionLocal
+from app.services.currency_service import CurrencyService
+from app.schemas.currency import CurrencyRateResponse
+from app.debug.tracing import traced
+from app.nats.client import nats_client
+from config import settings
+
+
+# Канал NATS, через который узлы пересылают друг другу события своих клиентов
+EVENTS_SUBJECT = "items.events"
+
+
+def _coalesce_key(message: dict) -> Hashable:
+    """Ключ, по которому события объединяются в окне: валютная пара или тип события"""
+    item = message.get("item")
+    if isinstance(item, dict) and "target_currency" in item:
+        return (item.get("base_currency"), item.get("target_currency"))
+    return message.get("type")
+
+
+def _matches(key: Hashable, pairs: Optional[Set[Tuple[str, str]]]) -> bool:
+    """События без валютной пары (итог фоновой задачи) проходят любой фильтр"""
+    return not pairs or not isinstance(key, tuple) or key in pairs
+
+
+class StreamSubscriber:
+    def __init__(self, pairs: Optional[Set[Tuple[str, str]]] = None):
+        self.pairs = pairs
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=settings.sse_queue_size)
+        self.overflowed = False
 
 
 class ConnectionManager:
     def __init__(self):
         self.active_connections: List[WebSocket] = []
-    
-    async def connect(self, websocket: WebSocket):
+        # Окно объединения (в секундах) для подключений, которые его запросили
+        self.coalesce_windows: Dict[WebSocket, float] = {}
+        self.pending: Dict[WebSocket, Dict[Hashable, dict]] = {}
+        self.flush_tasks: Dict[WebSocket, asyncio.Task] = {}
+        # Эпоха процесса: номера событий имеют смысл только внутри неё, поэтому
+        # возобновление с чужой эпохой (другой процесс, перезапуск) получает снимок
+        self.epoch = secrets.token_hex(4)
+        # Номер последнего события
+        self.seq = 0
+        self.event_log: Deque[Tuple[int, Hashable, str]] = deque(maxlen=settings.ws_event_log_size)
+        self.stream_subscribers: List[StreamSubscriber] = []
+        self.snapshot: Optional[Tuple[int, asyncio.Task]] = None
+
+    async def connect(self, websocket: WebSocket, coalesce_ms: int = 0):
+        """Принимает подключение; рассылка начинается только после sync()"""
         await websocket.accept()
+        if coalesce_ms > 0:
+            self.coalesce_windows[websocket] = coalesce_ms / 1000
+
+    async def sync(
+        self,
+        websocket: WebSocket,
+        resume_from: Optional[int] = None,
+        epoch: Optional[str] = None
+    ):
+        """Досылает пропущенные события из кольца (или снимок) и подключает к рассылке"""
+        async for _, payload in self.replay(resume_from, epoch):
+            await websocket.send_text(payload)
+
+        # Между последней проверкой в replay() и добавлением нет await, поэтому пропусков нет
         self.active_connections.append(websocket)
         print(f"WebSocket подключен. Всего подключений: {len(self.active_connections)}")
-    
+
+    async def stream(
+        self,
+        last_event_id: Optional[str] = None,
+        pairs: Optional[Set[Tuple[str, str]]] = None
+    ) -> AsyncIterator[str]:
+        """SSE-поток: снимок или пропущенные события, затем общая рассылка broadcast()"""
+        # id события в SSE — "<epoch>:<seq>"
+        epoch, _, seq = (last_event_id or "").partition(":")
+        last_seq = int(seq) if seq.isdigit() else None
+        async for seq, payload in self.replay(last_seq, epoch, pairs):
+            yield f"id: {self.epoch}:{seq}\ndata: {payload}\n\n"
+
+        subscriber = StreamSubscriber(pairs)
+        self.stream_subscribers.append(subscriber)
+        print(f"SSE подключен. Всего подписчиков: {len(self.stream_subscribers)}")
+        try:
+            # После переполнения очереди дочитываем её и закрываем поток:
+            # клиент переподключится с Last-Event-ID и досчитает пропуск из кольца
+            while not (subscriber.overflowed and subscriber.queue.empty()):
+                try:
+                    yield await asyncio.wait_for(
+                        subscriber.queue.get(), timeout=settings.sse_keepalive_seconds
+                    )
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+        finally:
+            if subscriber in self.stream_subscribers:
+                self.stream_subscribers.remove(subscriber)
+            print(f"SSE отключен. Всего подписчиков: {len(self.stream_subscribers)}")
+
+    async def replay(
+        self,
+        last_seq: Optional[int] = None,
+        epoch: Optional[str] = None,
+        pairs: Optional[Set[Tuple[str, str]]] = None
+    ) -> AsyncIterator[Tuple[int, str]]:
+        """Отдаёт (seq, payload) событий после last_seq либо снимок, пока не догонит self.seq"""
+        if epoch != self.epoch:
+            last_seq = None
+        while last_seq != self.seq:
+            if not self._can_replay(last_seq):
+                last_seq, payload = await self._get_snapshot(pairs)
+                yield last_seq, payload
+                continue
+            for seq, key, payload in list(self.event_log):
+                if seq <= last_seq:
+                    continue
+                last_seq = seq
+                if _matches(key, pairs):
+                    yield seq, payload
+
+    def _can_replay(self, last_seq: Optional[int]) -> bool:
+        if last_seq is None or last_seq > self.seq:
+            return False
+        if last_seq == self.seq:
+            return True
+        return bool(self.event_log) and self.event_log[0][0] <= last_seq + 1
+
+    async def _get_snapshot(
+        self, pairs: Optional[Set[Tuple[str, str]]] = None
+    ) -> Tuple[int, str]:
+        seq = self.seq
+        # Один запрос к БД на номер события: одновременные подключения делят снимок
+        if self.snapshot is None or self.snapshot[0] != seq:
+            self.snapshot = (seq, asyncio.create_task(self._load_snapshot(seq)))
+        task = self.snapshot[1]
+        try:
+            items, payload = await asyncio.shield(task)
+        except Exception:
+            if self.snapshot and self.snapshot[1] is task:
+                self.snapshot = None
+            raise
+
+        if pairs:
+            payload = json.dumps({
+                "type": "snapshot",
+                "epoch": self.epoch,
+                "seq": seq,
+                "items": [
+                    item for item in items
+                    if (item["base_currency"], item["target_currency"]) in pairs
+                ]
+            })
+        return seq, payload
+
+    async def _load_snapshot(self, seq: int) -> Tuple[List[dict], str]:
+        async with AsyncSessionLocal() as session:
+            items = await CurrencyService.get_all(session)
+        items = [
+            CurrencyRateResponse.model_validate(item).model_dump(mode="json")
+            for item in items
+        ]
+        return items, json.dumps({
+            "type": "snapshot",
+            "epoch": self.epoch,
+            "seq": seq,
+            "items": items
+        })
+
     def disconnect(self, websocket: WebSocket):
         if websocket in self.active_connections:
             self.active_connections.remove(websocket)
+        self.coalesce_windows.pop(websocket, None)
+        self.pending.pop(websocket, None)
+        task = self.flush_tasks.pop(websocket, None)
+        if task:
+            task.cancel()
         print(f"WebSocket отключен. Всего подключений: {len(self.active_connections)}")
-    
+
     async def send_personal_message(self, message: dict, websocket: WebSocket):
         try:
             await websocket.send_text(json.dumps(message))
         except Exception as e:
             print(f"Ошибка отправки сообщения: {e}")
             self.disconnect(websocket)
-    
-    async def broadcast(self, message: dict):
+
+    @traced("publish")
+    async def broadcast(self, message: dict, relay: bool = True):
+        """Рассылка своим клиентам; relay — переслать событие другим узлам через NATS"""
+        event = message
+        self.seq += 1
+        message = {**message, "epoch": self.epoch, "seq": self.seq}
+        # Сериализуем один раз: для журнала, SSE и всех подключений без окна объединения
+        payload = json.dumps(message)
+        key = _coalesce_key(message)
+        self.event_log.append((self.seq, key, payload))
+
+        if self.stream_subscribers:
+            frame = f"id: {self.epoch}:{self.seq}\ndata: {payload}\n\n"
+            for subscriber in list(self.stream_subscribers):
+                if not _matches(key, subscriber.pairs):
+                    continue
+                try:
+                    subscriber.queue.put_nowait(frame)
+                except asyncio.QueueFull:
+                    subscriber.overflowed = True
+                    self.stream_subscribers.remove(subscriber)
+
         disconnected = []
-        for connection in self.active_connections:
+        for connection in list(self.active_connections):
+            if connection in self.coalesce_windows:
+                self._enqueue(connection, key, message)
+                continue
+
             try:
-                await connection.send_text(json.dumps(message))
+                await connection.send_text(payload)
             except Exception as e:
                 print(f"Ошибка broadcast: {e}")
                 disconnected.append(connection)
-        
+
         for conn in disconnected:
             self.disconnect(conn)
 
+        if relay:
+            await nats_client.publish(EVENTS_SUBJECT, {"origin": self.epoch, "event": event})
 
-ws_manager = ConnectionManager()
+    async def handle_peer_event(self, data: dict):
+        """Событие другого узла из NATS: рассылаем своим клиентам под своим seq"""
+        if data.get("origin") == self.epoch or not isinstance(data.get("event"), dict):
+            return
+        await self.broadcast(data["event"], relay=False)
+
+    def _enqueue(self, websocket: WebSocket, key: Hashable, message: dict):
+        pending = self.pending.setdefault(websocket, {})
+        # Пара + id записи: удаление и повторное создание пары остаются отдельными событиями
+        item = message.get("item")
+        if isinstance(key, tuple) and isinstance(item, dict):
+            key = (key, item.get("id"))
+        previous = pending.pop(key, None)
+        previous_type = previous.get("type") if previous else None
+
+        if previous_type == "item_created" and message.get("type") == "item_deleted":
+            # Запись создана и удалена в пределах окна — клиенту отправлять нечего
+            return
+        if previous_type == "item_created" and message.get("type") == "item_updated":
+            # Создание и последующие обновления — одно item_created с последним курсом
+            created = previous["item"]
+            message = {
+                **message,
+                "type": "item_created",
+                "item": {
+                    "id": created.get("id"),
+                    "base_currency": created.get("base_currency"),
+                    "target_currency": created.get("target_currency"),
+                    "rate": item.get("new_rate")
+                }
+            }
+        elif previous_type == "item_updated" and message.get("type") == "item_updated":
+            # Для серии обновлений одной пары сохраняем исходный old_rate
+            message = {
+                **message,
+                "item": {**item, "old_rate": previous["item"].get("old_rate")}
+            }
 
+        pending[key] = message
+
+        if websocket not in self.flush_tasks:
+            self.flush_tasks[websocket] = asyncio.create_task(
+                self._flush_after(websocket, self.coalesce_windows[websocket])
+            )
+
+    async def _flush_after(self, websocket: WebSocket, window: float):
+        await asyncio.sleep(window)
+        self.flush_tasks.pop(websocket, None)
+        pending = self.pending.pop(websocket, None)
+        if not pending:
+            return
+
+        try:
+            await websocket.send_text(json.dumps(list(pending.values())))
+        except Exception as e:
+            print(f"Ошибка broadcast: {e}")
+            self.disconnect(websocket)
+
+
+ws_manager = ConnectionManager()
 
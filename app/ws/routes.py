@@ -1,6 +1,8 @@
+from typing import Optional
 from fastapi import APIRouter, WebSocket, WebSocketDisconnect
 from app.ws.manager import ws_manager
 from app.nats.client import nats_client
+from config import settings
 import json
 
 
@@ -8,8 +10,17 @@ router = APIRouter()
 
 
 @router.websocket("/ws/items")
-async def websocket_endpoint(websocket: WebSocket):
-    await ws_manager.connect(websocket)
+async def websocket_endpoint(
+    websocket: WebSocket,
+    coalesce_ms: Optional[int] = None,
+    resume_from: Optional[int] = None,
+    epoch: Optional[str] = None
+):
+    # Окно объединения событий: из query-параметра ?coalesce_ms=50 или из настроек
+    if coalesce_ms is None:
+        coalesce_ms = settings.ws_coalesce_window_ms
+    coalesce_ms = max(0, min(coalesce_ms, settings.ws_coalesce_max_window_ms))
+    await ws_manager.connect(websocket, coalesce_ms)
     
     try:
         await ws_manager.send_personal_message({
@@ -17,6 +28,9 @@ async def websocket_endpoint(websocket: WebSocket):
             "message": "Подключено к WebSocket. Ожидайте обновления курсов валют."
         }, websocket)
         
+        # Снимок или пропущенные события с ?resume_from=<seq>&epoch=<epoch>
+        await ws_manager.sync(websocket, resume_from, epoch)
+        
         while True:
             data = await websocket.receive_text()
             try:
@@ -35,6 +49,9 @@ async def websocket_endpoint(websocket: WebSocket):
                 }, websocket)
     
     except WebSocketDisconnect:
+        pass
+    finally:
+        # В том числе при ошибке снимка или отправки в sync()
         ws_manager.disconnect(websocket)
 
 
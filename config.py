@@ -4,10 +4,29 @@ from typing import Optional
 
 class Settings(BaseSettings):
     database_url: str = "sqlite+aiosqlite:///./currency.db"
+    db_pool_size: int = 10
+    db_max_overflow: int = 20
+    db_pool_pre_ping: bool = True
+    db_pool_recycle_seconds: int = 1800
+    db_statement_cache_size: int = 100
+    db_copy_min_rows: int = 100
     nats_url: str = "nats://localhost:4222"
     task_interval_seconds: int = 60
+    # False — узел не запускает периодическую задачу (ведомые узлы)
+    background_task_enabled: bool = True
     exchange_rates_api_url: str = "https://api.exchangerate-api.com/v4/latest/USD"
     api_type: str = "crypto"
+    # Пул для разбора ответов провайдеров и сравнения курсов: process | thread | none
+    worker_pool_type: str = "process"
+    worker_pool_size: int = 1
+    ws_coalesce_window_ms: int = 0
+    ws_coalesce_max_window_ms: int = 1000
+    ws_event_log_size: int = 1000
+    sse_queue_size: int = 1000
+    sse_keepalive_seconds: float = 15.0
+    admin_token: Optional[str] = None
+    tracing_enabled: bool = False
+    trace_buffer_size: int = 1000
     
     class Config:
         env_file = ".env"
@@ -3,9 +3,14 @@ from contextlib import asynccontextmanager
 import asyncio
 from app.api.routes import router as api_router
 from app.ws.routes import router as ws_router
+from app.debug.routes import router as debug_router
+from app.debug.tracing import TracingMiddleware
 from app.db.database import init_db
 from app.nats.client import nats_client
 from app.tasks.background_task import background_task
+from app.tasks.worker_pool import worker_pool
+from app.ws.manager import ws_manager, EVENTS_SUBJECT
+from config import settings
 
 
 @asynccontextmanager
@@ -15,15 +20,22 @@ async def lifespan(app: FastAPI):
     await init_db()
     print("База данных инициализирована")
     
+    worker_pool.start()
+    
     await nats_client.connect()
     
     async def handle_nats_message(data: dict):
         print(f"📨 Обработка сообщения из NATS: {data}")
     
     await nats_client.subscribe("items.updates", handle_nats_message)
+    # События других узлов (общая БД) — своим WebSocket/SSE-клиентам
+    await nats_client.subscribe(EVENTS_SUBJECT, ws_manager.handle_peer_event)
     
-    task = asyncio.create_task(background_task.start_periodic())
-    background_task.task = task
+    if settings.background_task_enabled:
+        task = asyncio.create_task(background_task.start_periodic())
+        background_task.task = task
+    else:
+        print("Периодическая фоновая задача отключена (BACKGROUND_TASK_ENABLED=false)")
     
     print("Приложение запущено")
     print("API документация: http://localhost:8000/docs")
@@ -33,6 +45,7 @@ async def lifespan(app: FastAPI):
     
     print("Остановка приложения...")
     await background_task.stop()
+    worker_pool.shutdown()
     await nats_client.disconnect()
     print("Приложение остановлено")
 
@@ -44,8 +57,11 @@ app = FastAPI(
     lifespan=lifespan
 )
 
+app.add_middleware(TracingMiddleware, exclude_paths={"/items/stream"})
+
 app.include_router(api_router, tags=["API"])
 app.include_router(ws_router, tags=["WebSocket"])
+app.include_router(debug_router, tags=["Debug"])
 
 
 @app.get("/")
@@ -64,6 +80,13 @@ async def health():
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
+    uvicorn.run(
+        "main:app",
+        host="0.0.0.0",
+        port=8000,
+        reload=True,
+        ws="websockets",
+        ws_per_message_deflate=True
+    )
 
 
@@ -0,0 +1,45 @@
+import asyncio
+import os
+import pytest
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from app.db.database import Base, _engine_options, init_db
+import app.tasks.background_task as background_task_module
+
+
+# PostgreSQL для тестов: например
+# TEST_POSTGRES_URL=postgresql+asyncpg://postgres@localhost:5432/currency_test
+POSTGRES_URL = os.environ.get("TEST_POSTGRES_URL")
+
+
+@pytest.fixture(params=["sqlite", "postgresql"])
+def database_url(request, tmp_path):
+    if request.param == "sqlite":
+        return f"sqlite+aiosqlite:///{tmp_path / 'test.db'}"
+    if not POSTGRES_URL:
+        pytest.skip("TEST_POSTGRES_URL не задан")
+    return POSTGRES_URL
+
+
+@pytest.fixture
+def run_db(database_url, monkeypatch):
+    """Запускает async-тест с чистой БД; тест получает engine и фабрику сессий"""
+    def run(test):
+        async def wrapper():
+            engine = create_async_engine(database_url, **_engine_options(database_url))
+            session_factory = async_sessionmaker(
+                engine, class_=AsyncSession, expire_on_commit=False
+            )
+            monkeypatch.setattr(background_task_module, "AsyncSessionLocal", session_factory)
+            try:
+                async with engine.begin() as conn:
+                    await conn.run_sync(Base.metadata.drop_all)
+                await init_db(engine)
+                await test(engine, session_factory)
+            finally:
+                async with engine.begin() as conn:
+                    await conn.run_sync(Base.metadata.drop_all)
+                await engine.dispose()
+
+        asyncio.run(wrapper())
+
+    return run
@@ -0,0 +1,23 @@
+from app.tasks.background_task import BackgroundTask
+
+
+def test_only_one_node_runs_periodic_task(run_db):
+    async def test(engine, session_factory):
+        leader, follower = BackgroundTask(engine), BackgroundTask(engine)
+        try:
+            assert await leader.acquire_leadership()
+            assert await leader.acquire_leadership()
+            if engine.dialect.name == "postgresql":
+                assert not await follower.acquire_leadership()
+            else:
+                # SQLite — один узел, блокировка не нужна
+                assert await follower.acquire_leadership()
+
+            # Лидер остановился — цикл подхватывает другой узел
+            await leader.release_leadership()
+            assert await follower.acquire_leadership()
+        finally:
+            await leader.release_leadership()
+            await follower.release_leadership()
+
+    run_db(test)
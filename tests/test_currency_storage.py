@@ -0,0 +1,124 @@
+import asyncio
+from sqlalchemy import func, select, text
+from app.models.currency import CurrencyRate, currency_pair_index
+from app.services.currency_service import CurrencyService
+from app.tasks.background_task import background_task
+from app.db.database import init_db
+from config import settings
+
+
+def _rates(count: int, offset: float = 0.0) -> dict:
+    return {f"C{i:04d}": round(1.0 + i + offset, 4) for i in range(count)}
+
+
+def test_upsert_rates_inserts_then_updates(run_db):
+    async def test(engine, session_factory):
+        async with session_factory() as session:
+            inserted = await CurrencyService.upsert_rates(session, "USD", {"EUR": 0.9, "GBP": 0.7})
+            await session.commit()
+        ids = {target: item_id for item_id, target, _ in inserted}
+        assert set(ids) == {"EUR", "GBP"}
+
+        async with session_factory() as session:
+            updated = await CurrencyService.upsert_rates(session, "USD", {"EUR": 0.95})
+            await session.commit()
+        assert updated == [(ids["EUR"], "EUR", 0.95)]
+
+        async with session_factory() as session:
+            rates = await CurrencyService.get_rates_by_base(session, "USD")
+            eur = await CurrencyService.get_by_id(session, ids["EUR"])
+        assert rates == {"EUR": 0.95, "GBP": 0.7}
+        assert eur.updated_at is not None
+
+    run_db(test)
+
+
+def test_upsert_rates_bulk_batch(run_db):
+    # Не меньше DB_COPY_MIN_ROWS (COPY в PostgreSQL) и больше одного пакета INSERT в SQLite
+    count = max(settings.db_copy_min_rows, 300) + 50
+
+    async def test(engine, session_factory):
+        for offset in (0.0, 0.5):
+            async with session_factory() as session:
+                upserted = await CurrencyService.upsert_rates(session, "USD", _rates(count, offset))
+                await session.commit()
+            assert len(upserted) == count
+            assert {target: rate for _, target, rate in upserted} == _rates(count, offset)
+
+        async with session_factory() as session:
+            total = await session.scalar(select(func.count()).select_from(CurrencyRate))
+            rates = await CurrencyService.get_rates_by_base(session, "USD")
+        assert total == count
+        assert rates == _rates(count, 0.5)
+
+    run_db(test)
+
+
+def test_save_rates_to_db_emits_events_for_changes_only(run_db):
+    async def test(engine, session_factory):
+        rates = _rates(5)
+        events = await background_task.save_rates_to_db("USD", {**rates, "USD": 1.0})
+        assert sorted(event["item"]["target_currency"] for event in events) == sorted(rates)
+        assert {event["type"] for event in events} == {"item_created"}
+
+        # Все пары без изменений — ни событий, ни записей
+        assert await background_task.save_rates_to_db("USD", rates) == []
+
+        events = await background_task.save_rates_to_db("USD", {**rates, "C0001": 42.0})
+        assert len(events) == 1
+        assert events[0]["type"] == "item_updated"
+        assert events[0]["item"]["old_rate"] == rates["C0001"]
+        assert events[0]["item"]["new_rate"] == 42.0
+
+        async with session_factory() as session:
+            assert await CurrencyService.get_rates_by_base(session, "USD") == {
+                **rates, "C0001": 42.0
+            }
+
+    run_db(test)
+
+
+def test_save_rates_to_db_bulk_unchanged(run_db):
+    count = settings.db_copy_min_rows + 10
+
+    async def test(engine, session_factory):
+        rates = _rates(count)
+        assert len(await background_task.save_rates_to_db("USD", rates)) == count
+        assert await background_task.save_rates_to_db("USD", rates) == []
+
+    run_db(test)
+
+
+def test_init_db_dedupes_pairs_before_unique_index(run_db):
+    async def test(engine, session_factory):
+        async with engine.begin() as conn:
+            await conn.run_sync(currency_pair_index.drop)
+            await conn.execute(text(
+                "INSERT INTO currency_rates (base_currency, target_currency, rate, updated_at) "
+                "VALUES ('USD', 'EUR', 1.0, '2030-01-01 00:00:00'), "
+                "('USD', 'EUR', 2.0, NULL), ('USD', 'GBP', 3.0, NULL)"
+            ))
+
+        await init_db(engine)
+
+        async with session_factory() as session:
+            assert await CurrencyService.get_rates_by_base(session, "USD") == {
+                "EUR": 1.0, "GBP": 3.0
+            }
+
+    run_db(test)
+
+
+def test_init_db_concurrent_startup(run_db):
+    async def test(engine, session_factory):
+        async with engine.begin() as conn:
+            await conn.run_sync(currency_pair_index.drop)
+
+        # Несколько узлов стартуют одновременно с общей БД
+        await asyncio.gather(*(init_db(engine) for _ in range(4)))
+
+        async with session_factory() as session:
+            await CurrencyService.upsert_rates(session, "USD", {"EUR": 1.0})
+            await session.commit()
+
+    run_db(test)
@@ -0,0 +1,29 @@
+import asyncio
+import os
+import pytest
+from concurrent.futures import BrokenExecutor
+from app.tasks.worker_pool import WorkerPool
+from config import settings
+
+
+def _crash():
+    os._exit(1)
+
+
+def test_worker_pool_recovers_after_worker_crash(monkeypatch):
+    monkeypatch.setattr(settings, "worker_pool_type", "process")
+
+    async def test():
+        pool = WorkerPool()
+        pool.start()
+        try:
+            # Повтор после пересоздания тоже падает — ошибка доходит до вызывающего
+            with pytest.raises(BrokenExecutor):
+                await pool.run(_crash)
+            # Следующие задачи выполняются в новом пуле
+            assert await pool.run(sum, [1, 2, 3]) == 6
+            assert await pool.run(sum, [4, 5]) == 9
+        finally:
+            pool.shutdown()
+
+    asyncio.run(test())
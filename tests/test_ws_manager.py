@@ -0,0 +1,169 @@
+import asyncio
+import json
+from collections import deque
+from app.ws.manager import ConnectionManager
+
+
+class StubWebSocket:
+    """Вместо WebSocket: запоминает отправленное, может вызвать действие при отправке"""
+
+    def __init__(self, on_send=None):
+        self.sent = []
+        self.on_send = on_send
+
+    async def send_text(self, data: str):
+        self.sent.append(json.loads(data))
+        if self.on_send:
+            await self.on_send(self)
+
+
+def _manager(log_size: int = 1000) -> ConnectionManager:
+    manager = ConnectionManager()
+    manager.event_log = deque(maxlen=log_size)
+
+    # Снимок без БД: пустой список курсов на момент seq
+    async def load_snapshot(seq):
+        return [], json.dumps({"type": "snapshot", "epoch": manager.epoch, "seq": seq, "items": []})
+
+    manager._load_snapshot = load_snapshot
+    return manager
+
+
+def _event(event_type: str, item_id: int, **item) -> dict:
+    return {
+        "type": event_type,
+        "item": {"id": item_id, "base_currency": "USD", "target_currency": "EUR", **item}
+    }
+
+
+async def _broadcast(manager: ConnectionManager, count: int):
+    for i in range(count):
+        await manager.broadcast(_event("item_updated", 1, old_rate=i, new_rate=i + 1))
+
+
+async def _replay(manager: ConnectionManager, last_seq, epoch):
+    return [json.loads(payload) async for _, payload in manager.replay(last_seq, epoch)]
+
+
+def test_replay_returns_missed_events():
+    async def test():
+        manager = _manager()
+        await _broadcast(manager, 5)
+        messages = await _replay(manager, 2, manager.epoch)
+        assert [message["seq"] for message in messages] == [3, 4, 5]
+        assert await _replay(manager, 5, manager.epoch) == []
+
+    asyncio.run(test())
+
+
+def test_replay_after_ring_wrap_returns_snapshot():
+    async def test():
+        manager = _manager(log_size=3)
+        await _broadcast(manager, 5)
+        assert not manager._can_replay(1)
+        assert manager._can_replay(2)
+        messages = await _replay(manager, 1, manager.epoch)
+        assert [(message["type"], message["seq"]) for message in messages] == [("snapshot", 5)]
+
+    asyncio.run(test())
+
+
+def test_replay_with_foreign_or_missing_epoch_returns_snapshot():
+    async def test():
+        manager = _manager()
+        await _broadcast(manager, 3)
+        for epoch in ("other", None):
+            messages = await _replay(manager, 2, epoch)
+            assert [(message["type"], message["seq"]) for message in messages] == [("snapshot", 3)]
+
+    asyncio.run(test())
+
+
+def test_replay_from_future_seq_returns_snapshot():
+    async def test():
+        manager = _manager()
+        await _broadcast(manager, 2)
+        assert not manager._can_replay(5)
+        messages = await _replay(manager, 5, manager.epoch)
+        assert [(message["type"], message["seq"]) for message in messages] == [("snapshot", 2)]
+
+    asyncio.run(test())
+
+
+def test_sync_hands_off_without_gap():
+    async def test():
+        manager = _manager()
+        await _broadcast(manager, 2)
+
+        # Пока клиенту досылается журнал, появляются новые события
+        async def on_send(websocket):
+            if manager.seq < 5:
+                await _broadcast(manager, 1)
+
+        websocket = StubWebSocket(on_send)
+        await manager.sync(websocket, 0, manager.epoch)
+        assert websocket in manager.active_connections
+
+        websocket.on_send = None
+        await _broadcast(manager, 1)
+        assert [message["seq"] for message in websocket.sent] == [1, 2, 3, 4, 5, 6]
+
+    asyncio.run(test())
+
+
+def _coalesce(messages):
+    async def test():
+        manager = _manager()
+        websocket = StubWebSocket()
+        manager.coalesce_windows[websocket] = 60
+        manager.active_connections.append(websocket)
+        for message in messages:
+            await manager.broadcast(message)
+        pending = list(manager.pending.get(websocket, {}).values())
+        manager.disconnect(websocket)
+        return pending
+
+    return asyncio.run(test())
+
+
+def test_coalesce_created_then_updated():
+    pending = _coalesce([
+        _event("item_created", 1, rate=1.0),
+        _event("item_updated", 1, old_rate=1.0, new_rate=1.1),
+        _event("item_updated", 1, old_rate=1.1, new_rate=1.2)
+    ])
+    assert len(pending) == 1
+    assert pending[0]["type"] == "item_created"
+    assert pending[0]["item"] == {
+        "id": 1, "base_currency": "USD", "target_currency": "EUR", "rate": 1.2
+    }
+
+
+def test_coalesce_created_then_deleted():
+    pending = _coalesce([
+        _event("item_created", 1, rate=1.0),
+        _event("item_updated", 1, old_rate=1.0, new_rate=1.1),
+        _event("item_deleted", 1, rate=1.1)
+    ])
+    assert pending == []
+
+
+def test_coalesce_updates_keep_first_old_rate():
+    pending = _coalesce([
+        _event("item_updated", 1, old_rate=1.0, new_rate=1.1),
+        _event("item_updated", 1, old_rate=1.1, new_rate=1.2)
+    ])
+    assert len(pending) == 1
+    assert pending[0]["item"]["old_rate"] == 1.0
+    assert pending[0]["item"]["new_rate"] == 1.2
+    assert pending[0]["seq"] == 2
+
+
+def test_coalesce_delete_and_recreate_stay_separate():
+    pending = _coalesce([
+        _event("item_deleted", 1, rate=1.0),
+        _event("item_created", 2, rate=1.5)
+    ])
+    assert [(message["type"], message["item"]["id"]) for message in pending] == [
+        ("item_deleted", 1), ("item_created", 2)
+    ]